@@ -0,0 +1,174 @@
+# ================================================================================
+#                     Инкрементальный поиск ("с последнего запуска")
+# ================================================================================
+#
+# Для каждой пары (PST-файл, набор критериев) в каталоге результатов хранится:
+#   - folders    - для каждой папки, обработанной без ошибок: количество писем
+#                  и watermark - максимальное время получения (при его отсутствии -
+#                  отправки) среди обработанных писем, не позже начала запуска;
+#   - seen_ids   - идентификаторы обработанных писем без времени или с временем
+#                  из будущего: их нельзя отсечь по watermark;
+#   - failed_ids - идентификаторы писем, которые не удалось обработать.
+# При следующем запуске папки с неизменным количеством писем пропускаются,
+# письма не новее watermark своей папки отбрасываются до извлечения тела,
+# а письма из failed_ids обрабатываются повторно.
+# Папка, обход которой прервался ошибкой, сохраняет состояние прошлого запуска.
+
+import os
+import json
+from datetime import datetime, timezone
+
+# Имя файла состояния в каталоге результатов
+STATE_FILENAME = '.incremental_state.json'
+
+
+class IncrementalState:
+    """Состояние инкрементального поиска для одного PST-файла и одного запроса"""
+
+    def __init__(self, output_dir, pst_path, criteria):
+        self.state_path = os.path.join(output_dir, STATE_FILENAME)
+        self.pst_key = os.path.normcase(os.path.abspath(pst_path))
+        self.query_key = json.dumps(criteria, sort_keys=True, default=str, ensure_ascii=False)
+        self.state = self.load()
+
+        # Письма с временем позже начала запуска считаются письмами без времени
+        self.started = datetime.now(timezone.utc)
+
+        previous = self.state.get(self.pst_key, {}).get(self.query_key, {})
+        self.folders = {key: entry for key, entry in previous.get('folders', {}).items()
+                        if isinstance(entry, dict)}
+        self.seen_ids = set(previous.get('seen_ids', []))
+        self.failed_ids = set(previous.get('failed_ids', []))
+
+        # Состояние папки, которая обрабатывается сейчас
+        self.folder_watermark = None
+        self.new_watermark = None
+        self.folder_clean = True
+        self.watermark_frozen = False
+
+        self.skipped_folders = 0
+        self.skipped_messages = 0
+        self.failed_messages = 0
+        self.saved_messages = 0
+
+    def load(self):
+        """Читает файл состояния, при ошибке начинает с пустого состояния"""
+        if not os.path.exists(self.state_path):
+            return {}
+        try:
+            with open(self.state_path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError) as e:
+            print(f"[!] Не удалось прочитать состояние инкрементального поиска: {e}")
+            return {}
+
+    def describe(self):
+        """Выводит сведения о предыдущем запуске"""
+        if self.folders:
+            print(f"[+] Инкрементальный режим: сохранено состояние {len(self.folders)} папок, "
+                  f"писем для повторной обработки: {len(self.failed_ids)}")
+        else:
+            print("[+] Инкрементальный режим: предыдущих запусков нет, просматриваются все письма")
+
+    @staticmethod
+    def message_id(message):
+        """Идентификатор письма в PST или None, если его не удалось получить"""
+        try:
+            return getattr(message, 'identifier', None)
+        except Exception:
+            return None
+
+    @staticmethod
+    def folder_key(folder):
+        return str(getattr(folder, 'identifier', None) or getattr(folder, 'name', ''))
+
+    def folder_unchanged(self, folder):
+        """Проверяет, что количество писем в папке не изменилось с прошлого запуска"""
+        entry = self.folders.get(self.folder_key(folder))
+        if entry and entry.get('count') == folder.number_of_sub_messages:
+            self.skipped_folders += 1
+            return True
+        return False
+
+    def begin_folder(self, folder):
+        """Начинает обработку папки с ее watermark из прошлого запуска"""
+        entry = self.folders.get(self.folder_key(folder), {})
+        self.folder_watermark = None
+        if entry.get('watermark'):
+            self.folder_watermark = min(datetime.fromisoformat(entry['watermark']), self.started)
+        self.new_watermark = self.folder_watermark
+        self.folder_clean = True
+        self.watermark_frozen = False
+
+    def folder_processed(self, folder):
+        """Сохраняет состояние папки после ее полного обхода"""
+        self.folders[self.folder_key(folder)] = {
+            # Папку с необработанными письмами при следующем запуске не пропускаем
+            'count': folder.number_of_sub_messages if self.folder_clean else None,
+            'watermark': self.new_watermark.isoformat() if self.new_watermark else None,
+        }
+
+    def message_time(self, received_time, sent_time):
+        """Время письма для watermark: получение, при его отсутствии - отправка"""
+        message_time = received_time or sent_time
+        if message_time is None or message_time > self.started:
+            return None
+        return message_time
+
+    def already_seen(self, message, received_time, sent_time):
+        """Проверяет, было ли письмо обработано в прошлые запуски"""
+        identifier = self.message_id(message)
+        if identifier is not None and identifier in self.failed_ids:
+            return False
+        message_time = self.message_time(received_time, sent_time)
+        if message_time is None:
+            seen = identifier is not None and identifier in self.seen_ids
+        else:
+            # Письмо с временем, равным watermark, и есть последнее просмотренное
+            seen = self.folder_watermark is not None and message_time <= self.folder_watermark
+        if seen:
+            self.skipped_messages += 1
+        return seen
+
+    def message_processed(self, message, received_time, sent_time, saved=False):
+        """Учитывает успешно обработанное письмо в состоянии папки"""
+        identifier = self.message_id(message)
+        self.failed_ids.discard(identifier)
+        if saved:
+            self.saved_messages += 1
+        message_time = self.message_time(received_time, sent_time)
+        if message_time is None:
+            if identifier is not None:
+                self.seen_ids.add(identifier)
+        elif not self.watermark_frozen and (self.new_watermark is None or message_time > self.new_watermark):
+            self.new_watermark = message_time
+
+    def message_failed(self, message):
+        """Запоминает письмо, которое нужно обработать повторно"""
+        self.failed_messages += 1
+        self.folder_clean = False
+        identifier = self.message_id(message)
+        if identifier is not None:
+            self.failed_ids.add(identifier)
+        else:
+            # Письмо нельзя будет найти повторно - не продвигаем watermark папки
+            self.new_watermark = self.folder_watermark
+            self.watermark_frozen = True
+
+    def save(self):
+        """Сохраняет состояние папок и списки обработанных и необработанных писем"""
+        self.state.setdefault(self.pst_key, {})[self.query_key] = {
+            'folders': self.folders,
+            'seen_ids': sorted(self.seen_ids),
+            'failed_ids': sorted(self.failed_ids),
+            'updated': datetime.now().isoformat(timespec='seconds'),
+        }
+        temp_path = self.state_path + '.tmp'
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            json.dump(self.state, f, ensure_ascii=False, indent=2)
+        os.replace(temp_path, self.state_path)
+        print(f"[+] Пропущено неизмененных папок: {self.skipped_folders}, "
+              f"ранее просмотренных писем: {self.skipped_messages}")
+        if self.failed_messages:
+            print(f"[!] Не удалось обработать писем: {self.failed_messages}, "
+                  f"они будут обработаны повторно при следующем запуске")
@@ -5,6 +5,8 @@
 # usage: main.py [-h] --output-dir OUTPUT_DIR [--sender SENDER] [--recipient RECIPIENT] [--subject SUBJECT]
 #                [--body BODY] [-sent-after SENT_AFTER] [--sent-before SENT_BEFORE] [--received-after RECEIVED_AFTER]
 #                [--received-before RECEIVED_BEFORE] [--sent-time SENT_TIME] [--received-time RECEIVED_TIME]
+#                [--cache-mb CACHE_MB] [--page-kb PAGE_KB] [--readahead READAHEAD] [--mmap]
+#                [--stage-local] [--stage-dir STAGE_DIR] [--incremental]
 #                pst_file
 
 import os
@@ -14,10 +16,13 @@ import pypff
 import re
 import unicodedata
 from bs4 import BeautifulSoup
-from striprtf.striprtf import rtf_to_text
+from rtf_text import extract_rtf_text
 import zipfile
 import io
+import time
 from bs4 import Comment
+from pst_cache import PstSource
+from incremental import IncrementalState
 
 # Константа для временной зоны GMT+3
 GMT3 = timezone(timedelta(hours=3))
@@ -87,10 +92,8 @@ def get_message_body(message):
         # Пытаемся получить RTF тело
         rtf_body = getattr(message, 'rtf_body', None)
         if rtf_body:
-            if isinstance(rtf_body, bytes):
-                rtf_body = rtf_body.decode('utf-8', errors='replace')
-            if rtf_body:
-                return normalize_newlines(rtf_to_text(rtf_body.strip()))
+            # Кодировку \'xx определяет сам RTF (\ansicpg, \fcharset), поэтому передаем байты
+            return normalize_newlines(extract_rtf_text(rtf_body))
 
         # Пытаемся получить HTML тело
         html_body = getattr(message, 'html_body', None)
@@ -366,17 +369,21 @@ def save_message_as_txt(message, output_dir, msg_num):
             with open(filepath, 'w', encoding='utf-8', errors='replace') as f:
                 f.write('\n'.join(content))
 
-            # Теперь переименовываем текстовый файл с учетом количества вложений
+            # Теперь переименовываем текстовый файл и папку с вложениями с учетом количества вложений
             if saved_attachments > 0:
-                new_filename = f"{filename_base} ({saved_attachments} вложений)_{msg_num}.txt"
-                new_filepath = os.path.join(output_dir, new_filename)
+                new_base = f"{filename_base} ({saved_attachments} вложений)_{msg_num}"
+                # Письмо могло быть сохранено раньше (повторный запуск) - не затираем его
+                counter = 1
+                unique_base = new_base
+                while (os.path.exists(os.path.join(output_dir, f"{unique_base}.txt"))
+                       or os.path.exists(os.path.join(output_dir, unique_base))):
+                    unique_base = f"{new_base}_{counter}"
+                    counter += 1
+
+                new_filepath = os.path.join(output_dir, f"{unique_base}.txt")
                 os.rename(filepath, new_filepath)
                 filepath = new_filepath
-
-            # Переименовываем папку с вложениями
-            if saved_attachments > 0:
-                new_attachments_dir = os.path.join(output_dir, f"{filename_base} ({saved_attachments} вложений)_{msg_num}")
-                os.rename(attachments_dir, new_attachments_dir)
+                os.rename(attachments_dir, os.path.join(output_dir, unique_base))
 
             # Проверяем и удаляем пустую папку перед возвратом
             if attachments_dir and os.path.exists(attachments_dir):
@@ -418,61 +425,93 @@ def parse_time_range(time_str):
         print(f"[!] Ошибка при обработке диапазона времени {time_str}: {e}")
 
 
-def search_pst(pst_path, search_criteria, output_dir=None):
+def search_pst(pst_path, search_criteria, output_dir=None, io_options=None, incremental=False):
     """Основная функция поиска в PST-файле"""
     try:
         print(f"[+] Открываю PST-файл: {pst_path}")
-        pst = pypff.file()
-        pst.open(pst_path)
-
-        if output_dir:
-            ensure_output_dir(output_dir)
-            print(f"[+] Найденные письма будут сохранены в: {os.path.abspath(output_dir)}")
+        started = time.perf_counter()
+        source = PstSource(pst_path, io_options)
+        pst = source.pst
 
-        root = pst.get_root_folder()
-        print(f"[+] Найдено корневых папок: {root.number_of_sub_folders}")
-
-        total_messages = process_folder(root, search_criteria, 0, output_dir)
-
-        print(f"\n[+] Поиск завершен. Обработано сообщений: {total_messages}")
-        if output_dir and os.path.exists(output_dir):
-            txt_files = [f for f in os.listdir(output_dir) if f.endswith('.txt')]
-            print(f"[+] Сохранено писем: {len(txt_files)}")
-        pst.close()
+        try:
+            if output_dir:
+                ensure_output_dir(output_dir)
+                print(f"[+] Найденные письма будут сохранены в: {os.path.abspath(output_dir)}")
+
+            state = None
+            if incremental and output_dir:
+                state = IncrementalState(output_dir, pst_path, search_criteria)
+                state.describe()
+
+            root = pst.get_root_folder()
+            print(f"[+] Найдено корневых папок: {root.number_of_sub_folders}")
+
+            total_messages = process_folder(root, search_criteria, 0, output_dir, state)
+
+            # Состояние сохраняем только после полного обхода PST
+            if state:
+                state.save()
+
+            print(f"\n[+] Поиск завершен. Обработано сообщений: {total_messages}")
+            if state:
+                print(f"[+] Сохранено новых писем: {state.saved_messages}")
+            elif output_dir and os.path.exists(output_dir):
+                txt_files = [f for f in os.listdir(output_dir) if f.endswith('.txt')]
+                print(f"[+] Сохранено писем: {len(txt_files)}")
+        finally:
+            # Закрываем PST, выводим статистику кэша и удаляем локальную копию
+            source.close()
+        print(f"[+] Время обработки: {time.perf_counter() - started:.1f} с")
     except IOError as e:
         print(f"[!] Ошибка при открытии файла: {e}")
     except Exception as e:
         print(f"[!] Критическая ошибка: {e}")
 
 
-def process_folder(folder, search_criteria, counter, output_dir=None):
+def process_folder(folder, search_criteria, counter, output_dir=None, state=None):
     """Рекурсивно обрабатывает папки PST"""
     try:
-        for message in folder.sub_messages:
-            counter += 1
-            process_message(message, search_criteria, counter, output_dir)
+        if state and state.folder_unchanged(folder):
+            # Писем в папке столько же, сколько в прошлый раз - нумерация сохраняется
+            counter += folder.number_of_sub_messages
+        else:
+            if state:
+                state.begin_folder(folder)
+            for message in folder.sub_messages:
+                counter += 1
+                process_message(message, search_criteria, counter, output_dir, state)
+            if state:
+                state.folder_processed(folder)
 
         for subfolder in folder.sub_folders:
-            counter = process_folder(subfolder, search_criteria, counter, output_dir)
+            counter = process_folder(subfolder, search_criteria, counter, output_dir, state)
     except AttributeError as e:
+        # Состояние папки в инкрементальном режиме остается от прошлого запуска
         print(f"[!] Ошибка доступа к папке: {e}")
     except Exception as e:
         print(f"[!] Ошибка при обработке папки: {e}")
     return counter
 
 
-def process_message(message, search_criteria, msg_num, output_dir=None):
+def process_message(message, search_criteria, msg_num, output_dir=None, state=None):
     """Обрабатывает отдельное сообщение"""
     try:
-        sender = getattr(message, 'sender_name', 'Не указан')
-        subject = getattr(message, 'subject', 'Без темы')
-        body = get_message_body(message)
         # Конвертируем время в GMT+3
         received_time = convert_to_gmt3(getattr(message, 'delivery_time', None))
         sent_time = convert_to_gmt3(getattr(message, 'client_submit_time', None))
 
+        # Письма, просмотренные в прошлый запуск, отбрасываем до извлечения тела
+        if state and state.already_seen(message, received_time, sent_time):
+            return
+
+        sender = getattr(message, 'sender_name', 'Не указан')
+        subject = getattr(message, 'subject', 'Без темы')
+        body = get_message_body(message)
+
         if not matches_criteria(sender, subject, body,
                                 received_time, sent_time, search_criteria):
+            if state:
+                state.message_processed(message, received_time, sent_time)
             return
 
         print(f"\n[+] Найдено письмо #{msg_num}:")
@@ -481,10 +520,17 @@ def process_message(message, search_criteria, msg_num, output_dir=None):
         if sent_time:
             print(f"    Отправлено: {format_datetime_gmt3(sent_time)}")
 
-        if output_dir:
-            save_message_as_txt(message, output_dir, msg_num)
+        if output_dir and save_message_as_txt(message, output_dir, msg_num) is None:
+            # Письмо не сохранено - в инкрементальном режиме оно будет обработано снова
+            if state:
+                state.message_failed(message)
+            return
+        if state:
+            state.message_processed(message, received_time, sent_time, saved=bool(output_dir))
     except Exception as e:
         print(f"[!] Ошибка при обработке сообщения #{msg_num}: {e}")
+        if state:
+            state.message_failed(message)
 
 
 def main():
@@ -505,8 +551,27 @@ def main():
     parser.add_argument('--received-before', help='Письма, полученные до указанной даты (YYYY-MM-DD HH:MM:SS)')
     parser.add_argument('--sent-time', help='Диапазон часов отправки (формат: HH-HH, например 8-17 или 22-6)')
     parser.add_argument('--received-time', help='Диапазон часов получения (формат: HH-HH, например 8-17 или 22-6)')
+    parser.add_argument('--cache-mb', type=int, default=0,
+                        help='Открыть PST через блочный кэш указанного размера в МБ (для сетевых дисков)')
+    parser.add_argument('--page-kb', type=int, default=64, help='Размер страницы кэша в КБ (по умолчанию 64)')
+    parser.add_argument('--readahead', type=int, default=8,
+                        help='Количество страниц упреждающего чтения при последовательном доступе (по умолчанию 8)')
+    parser.add_argument('--mmap', action='store_true', help='Читать локальный PST через mmap')
+    parser.add_argument('--stage-local', action='store_true',
+                        help='Скопировать PST на локальный диск перед обработкой')
+    parser.add_argument('--stage-dir', help='Каталог для локальной копии PST (по умолчанию временный каталог)')
+    parser.add_argument('--incremental', action='store_true',
+                        help='Просматривать только письма, появившиеся после предыдущего запуска\n'
+                             'с теми же PST-файлом и критериями (состояние хранится в --output-dir)')
 
     args = parser.parse_args()
+    if args.cache_mb < 0:
+        parser.error('--cache-mb не может быть отрицательным')
+    if args.page_kb <= 0:
+        parser.error('--page-kb должен быть положительным')
+    if args.readahead <= 0:
+        parser.error('--readahead должен быть положительным')
+
     criteria = {}
     if args.sender: criteria['sender'] = args.sender
     if args.subject: criteria['subject'] = args.subject
@@ -535,7 +600,16 @@ def main():
         else:
             print("[!] Неверный формат диапазона времени для --received-time")
 
-    search_pst(args.pst_file, criteria, args.output_dir)
+    io_options = {
+        'cache_mb': args.cache_mb,
+        'page_kb': args.page_kb,
+        'readahead': args.readahead,
+        'mmap': args.mmap,
+        'stage_local': args.stage_local,
+        'stage_dir': args.stage_dir,
+    }
+
+    search_pst(args.pst_file, criteria, args.output_dir, io_options, args.incremental)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,234 @@
+# ================================================================================
+#                     Блочный кэш для PST-файлов на сетевых дисках
+# ================================================================================
+#
+# pypff читает PST множеством мелких случайных чтений, и через SMB (Y:\) обход
+# упирается в задержку сети. Здесь собраны способы открыть PST иначе, чем
+# pst.open(path):
+#   - CachedFile - файловый объект для pypff.file.open_file_object с LRU-кэшем
+#     выровненных страниц и упреждающим чтением при последовательном доступе;
+#   - mmap для локальных файлов;
+#   - stage_local - копирование PST на локальный диск перед обработкой.
+
+import os
+import sys
+import mmap
+import shutil
+import tempfile
+from collections import OrderedDict
+
+import pypff
+
+# Размер буфера при копировании PST на локальный диск
+COPY_BUFFER_SIZE = 16 * 1024 * 1024
+
+# Тип диска "сетевой" для GetDriveTypeW
+DRIVE_REMOTE = 4
+
+
+def is_local_path(path):
+    """Проверяет, что файл лежит на локальном диске, а не на сетевом ресурсе"""
+    path = os.path.abspath(path)
+    if path.startswith('\\\\') or path.startswith('//'):
+        return False
+    if sys.platform == 'win32':
+        import ctypes
+        drive = os.path.splitdrive(path)[0] + '\\'
+        return ctypes.windll.kernel32.GetDriveTypeW(drive) != DRIVE_REMOTE
+    return True
+
+
+class CachedFile:
+    """Файловый объект с LRU-кэшем страниц и упреждающим чтением"""
+
+    def __init__(self, path, cache_mb=64, page_kb=64, readahead=8, use_mmap=False):
+        if page_kb <= 0 or readahead <= 0:
+            raise ValueError(f"Размер страницы и упреждающее чтение должны быть положительными: "
+                             f"page_kb={page_kb}, readahead={readahead}")
+        self.path = path
+        self.page_size = page_kb * 1024
+        self.readahead = readahead
+        # Кэш должен вмещать хотя бы одну порцию упреждающего чтения
+        self.max_pages = max(self.readahead, cache_mb * 1024 * 1024 // self.page_size)
+        self.file = open(path, 'rb')
+        self.size = os.fstat(self.file.fileno()).st_size
+        self.offset = 0
+        self.pages = OrderedDict()
+        self.last_page = None
+        self.mmap = None
+        if use_mmap and self.size:
+            if is_local_path(path):
+                self.mmap = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+            else:
+                print("[!] mmap не используется: PST находится на сетевом диске, читаю через блочный кэш")
+
+        # Статистика для оценки эффективности кэша
+        self.hits = 0
+        self.misses = 0
+        self.disk_reads = 0
+        self.disk_bytes = 0
+
+    def load_pages(self, first, count):
+        """Читает до count страниц начиная с first одним обращением к файлу"""
+        last = min(first + count, (self.size + self.page_size - 1) // self.page_size)
+        # Упреждающее чтение останавливается на первой уже закэшированной странице
+        for number in range(first + 1, last):
+            if number in self.pages:
+                last = number
+                break
+        self.file.seek(first * self.page_size)
+        data = self.file.read((last - first) * self.page_size)
+        self.disk_reads += 1
+        self.disk_bytes += len(data)
+
+        for number in range(first, last):
+            start = (number - first) * self.page_size
+            self.pages[number] = data[start:start + self.page_size]
+            self.pages.move_to_end(number)
+        while len(self.pages) > self.max_pages:
+            self.pages.popitem(last=False)
+
+    def get_page(self, number):
+        """Возвращает страницу из кэша, при промахе подгружает ее с диска"""
+        page = self.pages.get(number)
+        if page is not None:
+            self.hits += 1
+            self.pages.move_to_end(number)
+        else:
+            self.misses += 1
+            # Последовательное чтение - подгружаем сразу несколько страниц вперед
+            sequential = self.last_page is not None and number == self.last_page + 1
+            self.load_pages(number, self.readahead if sequential else 1)
+            page = self.pages[number]
+        self.last_page = number
+        return page
+
+    def read(self, size=-1):
+        if size is None or size < 0:
+            size = self.size - self.offset
+        size = min(size, self.size - self.offset)
+        if size <= 0:
+            return b''
+
+        if self.mmap is not None:
+            data = self.mmap[self.offset:self.offset + size]
+            self.offset += size
+            return data
+
+        chunks = []
+        end = self.offset + size
+        position = self.offset
+        while position < end:
+            number, start = divmod(position, self.page_size)
+            page = self.get_page(number)
+            chunk = page[start:start + end - position]
+            if not chunk:
+                break
+            chunks.append(chunk)
+            position += len(chunk)
+        self.offset = position
+        return b''.join(chunks)
+
+    def seek(self, offset, whence=os.SEEK_SET):
+        if whence == os.SEEK_CUR:
+            offset += self.offset
+        elif whence == os.SEEK_END:
+            offset += self.size
+        if offset < 0:
+            raise IOError(f"Недопустимое смещение: {offset}")
+        self.offset = offset
+        return self.offset
+
+    def tell(self):
+        return self.offset
+
+    def get_offset(self):
+        return self.offset
+
+    def get_size(self):
+        return self.size
+
+    def close(self):
+        if self.mmap is not None:
+            self.mmap.close()
+            self.mmap = None
+        self.pages.clear()
+        self.file.close()
+
+    def print_stats(self):
+        """Выводит статистику попаданий в кэш"""
+        if self.mmap is not None:
+            print("[+] PST прочитан через mmap")
+            return
+        requests = self.hits + self.misses
+        hit_rate = self.hits / requests * 100 if requests else 0.0
+        print(f"[+] Кэш PST: попаданий {self.hits}, промахов {self.misses} ({hit_rate:.1f}% попаданий)")
+        print(f"    Чтений с диска: {self.disk_reads}, прочитано: {self.disk_bytes / (1024 * 1024):.1f} МБ")
+
+
+def stage_local(pst_path, stage_dir=None):
+    """Копирует PST на локальный диск и возвращает путь к копии"""
+    stage_dir = stage_dir or tempfile.gettempdir()
+    os.makedirs(stage_dir, exist_ok=True)
+    fd, local_path = tempfile.mkstemp(suffix='.pst', dir=stage_dir)
+    print(f"[+] Копирую PST-файл на локальный диск: {local_path}")
+    try:
+        with os.fdopen(fd, 'wb') as dst, open(pst_path, 'rb') as src:
+            shutil.copyfileobj(src, dst, COPY_BUFFER_SIZE)
+    except BaseException:
+        # Не оставляем во временном каталоге частичную копию многогигабайтного PST,
+        # в том числе при прерывании по Ctrl+C
+        os.remove(local_path)
+        raise
+    return local_path
+
+
+class PstSource:
+    """Открытый PST вместе с ресурсами, которые нужно освободить после обработки"""
+
+    def __init__(self, pst_path, io_options=None):
+        io_options = io_options or {}
+        self.cached_file = None
+        self.staged_path = None
+
+        path = pst_path
+        if io_options.get('stage_local'):
+            self.staged_path = stage_local(pst_path, io_options.get('stage_dir'))
+            path = self.staged_path
+
+        self.pst = pypff.file()
+        try:
+            if io_options.get('cache_mb') or io_options.get('mmap'):
+                self.cached_file = CachedFile(
+                    path,
+                    cache_mb=io_options.get('cache_mb') or 64,
+                    page_kb=io_options.get('page_kb') or 64,
+                    readahead=io_options.get('readahead') or 8,
+                    use_mmap=io_options.get('mmap', False)
+                )
+                self.pst.open_file_object(self.cached_file)
+            else:
+                self.pst.open(path)
+        except Exception:
+            self.release()
+            raise
+
+    def release(self):
+        """Закрывает файловый объект и удаляет локальную копию"""
+        if self.cached_file is not None:
+            self.cached_file.close()
+            self.cached_file = None
+        if self.staged_path and os.path.exists(self.staged_path):
+            try:
+                os.remove(self.staged_path)
+            except OSError as e:
+                print(f"[!] Не удалось удалить локальную копию {self.staged_path}: {e}")
+        self.staged_path = None
+
+    def close(self):
+        try:
+            self.pst.close()
+        finally:
+            if self.cached_file is not None:
+                self.cached_file.print_stats()
+            self.release()
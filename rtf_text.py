@@ -0,0 +1,351 @@
+# ================================================================================
+#                        Извлечение текста из RTF-тела письма
+# ================================================================================
+#
+# Однопроходный разбор RTF для get_message_body. В отличие от striprtf:
+#   - работает с байтами rtf_body как есть, без предварительного decode('utf-8');
+#   - учитывает \ansicpg, \fcharset шрифтов и \uN/\ucN (cp1251 в \'xx и в 8-битном тексте);
+#   - группы \pict, \object и прочие служебные назначения пропускаются
+#     поиском парной скобки, без разбора их содержимого на токены.
+#
+# Запуск как скрипта - проверка по образцам, сравнение с striprtf и замер
+# пропускной способности. Без аргументов используются образцы из samples/rtf
+# (рядом с каждым NAME.rtf лежит ожидаемый текст NAME.txt) и синтетическое письмо.
+#
+# usage: rtf_text.py [-h] [--repeat REPEAT] [rtf_file ...]
+
+import os
+import re
+import glob
+import codecs
+import time
+import argparse
+
+# Соответствие \fcharsetN кодовой странице. 0 (ANSI) и 1 (DEFAULT) не указаны:
+# для них используется \ansicpg документа - Outlook пишет \fcharset0 даже
+# в письмах с \ansicpg1251, а \'xx там фактически в cp1251.
+CHARSET_CODEPAGES = {
+    2: 'cp1252', 77: 'mac_roman', 128: 'cp932', 129: 'cp949', 130: 'johab',
+    134: 'gbk', 136: 'big5', 161: 'cp1253', 162: 'cp1254', 163: 'cp1258',
+    177: 'cp1255', 178: 'cp1256', 186: 'cp1257', 204: 'cp1251', 222: 'cp874',
+    238: 'cp1250', 254: 'cp437', 255: 'cp850',
+}
+
+# Назначения, содержимое которых не является текстом письма
+SKIP_DESTINATIONS = frozenset((
+    'aftncn', 'aftnsep', 'aftnsepc', 'annotation', 'atnauthor', 'atndate',
+    'atnicn', 'atnid', 'atnparent', 'atnref', 'atntime', 'atrfend', 'atrfstart',
+    'author', 'background', 'bkmkend', 'bkmkstart', 'blipuid', 'buptim',
+    'category', 'colorschememapping', 'colortbl', 'comment', 'company',
+    'creatim', 'datafield', 'datastore', 'defchp', 'defpap', 'do', 'doccomm',
+    'docvar', 'dptxbxtext', 'falt', 'fchars', 'ffdeftext', 'ffentrymcr',
+    'ffexitmcr', 'ffformat', 'ffhelptext', 'ffl', 'ffname', 'ffstattext',
+    'file', 'filetbl', 'fldinst', 'fldtype', 'fname', 'fontemb', 'fontfile',
+    'footer', 'footerf', 'footerl', 'footerr', 'footnote', 'formfield', 'ftncn',
+    'ftnsep', 'ftnsepc', 'generator', 'gridtbl', 'header', 'headerf', 'headerl',
+    'headerr', 'hl', 'hlfr', 'hlinkbase', 'hlloc', 'hlsrc', 'htmltag', 'info',
+    'keycode', 'keywords', 'latentstyles', 'lchars', 'levelnumbers', 'leveltext',
+    'lfolevel', 'linkval', 'list', 'listlevel', 'listname', 'listoverride',
+    'listoverridetable', 'listpicture', 'liststylename', 'listtable',
+    'lsdlockedexcept', 'mailmerge', 'manager', 'mhtmltag', 'nesttableprops',
+    'nextfile', 'nonesttables', 'objalias', 'objclass', 'objdata', 'object',
+    'objname', 'objsect', 'objtime', 'oldcprops', 'oldpprops', 'oldsprops',
+    'oldtprops', 'oleclsid', 'operator', 'panose', 'password', 'passwordhash',
+    'pgp', 'pgptbl', 'picprop', 'pict', 'pn', 'pnseclvl', 'pntext', 'pntxta',
+    'pntxtb', 'printim', 'private', 'propname', 'protend', 'protstart',
+    'protusertbl', 'pxe', 'revtbl', 'revtim', 'rsidtbl', 'rxe', 'shp', 'shpgrp',
+    'shpinst', 'shppict', 'sn', 'sp', 'staticval', 'stylesheet', 'subject',
+    'sv', 'svb', 'tc', 'template', 'themedata', 'title', 'txe', 'ud', 'upr',
+    'userprops', 'wgrffmtfilter', 'windowcaption', 'writereservation',
+    'writereservhash', 'xe', 'xform', 'xmlattrname', 'xmlattrvalue', 'xmlclose',
+    'xmlname', 'xmlnstbl', 'xmlopen',
+))
+
+# Управляющие слова и символы, которые дают текст
+SPECIAL_CHARS = {
+    'par': '\n', 'sect': '\n\n', 'page': '\n\n', 'line': '\n', 'row': '\n',
+    'tab': '\t', 'cell': '|', 'nestcell': '|',
+    'emdash': '\u2014', 'endash': '\u2013', 'emspace': '\u2003',
+    'enspace': '\u2002', 'qmspace': '\u2005', 'bullet': '\u2022',
+    'lquote': '\u2018', 'rquote': '\u2019',
+    'ldblquote': '\u201c', 'rdblquote': '\u201d',
+    '~': '\xa0', '-': '\xad', '_': '\u2011',
+    '{': '{', '}': '}', '\\': '\\', '\n': '\n', '\r': '\n',
+}
+
+# Токены RTF: управляющее слово, серия \'xx, управляющий символ, скобка, текст
+TOKEN_RE = re.compile(
+    r"\\([a-zA-Z]{1,32})(-?\d{1,10})? ?"
+    r"|((?:\\'[0-9a-fA-F]{2})+)"
+    r"|\\(.)"
+    r"|([{}])"
+    r"|[\r\n]+"
+    r"|([^\\{}\r\n]+)",
+    re.S
+)
+
+# Токены, важные при пропуске группы: \binN, экранированные символы, скобки
+SKIP_RE = re.compile(r"\\bin(\d+) ?|\\.|[{}]", re.S)
+
+# Каталог образцов RTF с ожидаемым текстом
+SAMPLES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'samples', 'rtf')
+
+FONT_RE = re.compile(r"\\f(\d+)(.*?)(?=\\f\d|$)", re.S)
+FCHARSET_RE = re.compile(r"\\fcharset(\d+)")
+ANSICPG_RE = re.compile(r"\\ansicpg(\d+)")
+
+
+def codepage_name(number, default='cp1252'):
+    """Возвращает имя кодека для номера кодовой страницы или default"""
+    name = f"cp{number}"
+    try:
+        codecs.lookup(name)
+        return name
+    except LookupError:
+        return default
+
+
+def skip_group(text, pos):
+    """Возвращает позицию сразу за закрывающей скобкой текущей группы"""
+    depth = 1
+    match = SKIP_RE.search(text, pos)
+    while match:
+        pos = match.end()
+        if match.group(1) is not None:
+            # Двоичные данные \binN пропускаем целиком
+            pos += int(match.group(1))
+        elif match.group() == '{':
+            depth += 1
+        elif match.group() == '}':
+            depth -= 1
+            if depth == 0:
+                return pos
+        match = SKIP_RE.search(text, pos)
+    return len(text)
+
+
+def parse_font_table(table, ansi_codepage):
+    """Возвращает соответствие номера шрифта его кодовой странице"""
+    fonts = {}
+    for match in FONT_RE.finditer(table):
+        charset = FCHARSET_RE.search(match.group(2))
+        if charset:
+            fonts[match.group(1)] = CHARSET_CODEPAGES.get(int(charset.group(1)), ansi_codepage)
+        else:
+            fonts[match.group(1)] = ansi_codepage
+    return fonts
+
+
+def extract_rtf_text(data, errors='replace'):
+    """Извлекает текст из RTF (bytes или str) за один проход"""
+    if not data:
+        return ''
+    raw = isinstance(data, bytes)
+    if raw:
+        # latin-1 сохраняет байты один к одному, \'xx и 8-битный текст декодируются ниже
+        text = data.decode('latin-1')
+    else:
+        text = data
+
+    ansicpg = ANSICPG_RE.search(text, 0, 512)
+    ansi_codepage = codepage_name(ansicpg.group(1)) if ansicpg else 'cp1252'
+
+    fonts = {}
+    default_font = None
+    default_codepage = ansi_codepage
+    codepage = ansi_codepage
+    ucskip = 1
+    curskip = 0
+    stack = []
+    out = []
+    depth = 0
+
+    pos = 0
+    length = len(text)
+    while pos < length:
+        match = TOKEN_RE.match(text, pos)
+        if match is None:
+            # Одиночный '\' в конце текста
+            break
+        pos = match.end()
+        word, arg, hex_run, symbol, brace, chars = match.groups()
+
+        if chars is not None:
+            if curskip:
+                skipped = min(curskip, len(chars))
+                curskip -= skipped
+                chars = chars[skipped:]
+            if chars:
+                if raw and not chars.isascii():
+                    # Неэкранированные 8-битные байты - в кодировке текущего шрифта
+                    chars = chars.encode('latin-1').decode(codepage, errors)
+                out.append(chars)
+        elif hex_run is not None:
+            # Серия \'xx декодируется целиком - многобайтные символы не рвутся
+            hex_digits = hex_run.replace("\\'", '')
+            if curskip:
+                skipped = min(curskip, len(hex_digits) // 2)
+                curskip -= skipped
+                hex_digits = hex_digits[skipped * 2:]
+            if hex_digits:
+                out.append(bytes.fromhex(hex_digits).decode(codepage, errors))
+        elif word is not None:
+            curskip = 0
+            if word in SKIP_DESTINATIONS or word == 'fonttbl':
+                # Группа не содержит текста письма - ищем парную скобку
+                pos_start = pos
+                end = skip_group(text, pos)
+                pos = end
+                if stack:
+                    ucskip, codepage = stack.pop()
+                depth -= 1
+                if word == 'fonttbl':
+                    fonts = parse_font_table(text[pos_start:end], ansi_codepage)
+                    # Шрифт \deffN действует до первого явного \fN
+                    default_codepage = fonts.get(default_font, ansi_codepage)
+                    codepage = default_codepage
+                continue
+            if word == 'bin':
+                pos += int(arg or 0)
+            elif word in SPECIAL_CHARS:
+                out.append(SPECIAL_CHARS[word])
+            elif word == 'u':
+                if arg is not None:
+                    code = int(arg)
+                    out.append(chr(code + 0x10000 if code < 0 else code))
+                curskip = ucskip
+            elif word == 'uc':
+                ucskip = int(arg or 1)
+            elif word == 'f':
+                codepage = fonts.get(arg, ansi_codepage)
+            elif word == 'plain':
+                codepage = default_codepage
+            elif word == 'deff':
+                default_font = arg
+                default_codepage = fonts.get(arg, ansi_codepage)
+        elif symbol is not None:
+            curskip = 0
+            if symbol == '*':
+                # Необязательное назначение \*\... - пропускаем всю группу
+                pos = skip_group(text, pos)
+                if stack:
+                    ucskip, codepage = stack.pop()
+                depth -= 1
+            elif symbol in SPECIAL_CHARS:
+                out.append(SPECIAL_CHARS[symbol])
+        elif brace == '{':
+            curskip = 0
+            depth += 1
+            stack.append((ucskip, codepage))
+        elif brace == '}':
+            curskip = 0
+            depth -= 1
+            if stack:
+                ucskip, codepage = stack.pop()
+            if depth <= 0:
+                # Всё после закрытия группы документа не отображается
+                break
+
+    result = ''.join(out)
+    # \uN с отрицательными значениями могут давать суррогатные пары
+    try:
+        result.encode('utf-8')
+    except UnicodeEncodeError:
+        result = result.encode('utf-16', 'surrogatepass').decode('utf-16', errors)
+    return result
+
+
+def normalize_for_compare(text):
+    """Схлопывает пробельные символы для сравнения результатов"""
+    return ' '.join(text.split())
+
+
+def check_expected(corpus):
+    """Сверяет результат с ожидаемым текстом из NAME.txt рядом с NAME.rtf"""
+    checked = failed = 0
+    for name, data in corpus:
+        expected_path = os.path.splitext(name)[0] + '.txt'
+        if not os.path.exists(expected_path):
+            continue
+        with open(expected_path, 'r', encoding='utf-8', newline='') as f:
+            expected = f.read()
+        checked += 1
+        if extract_rtf_text(data) != expected:
+            failed += 1
+            print(f"[!] Текст не совпадает с ожидаемым: {name}")
+    if checked:
+        print(f"[+] Проверено образцов: {checked}, ошибок: {failed}")
+    return failed == 0
+
+
+def benchmark(corpus, repeat):
+    """Сравнивает extract_rtf_text со striprtf и выводит пропускную способность"""
+    from striprtf.striprtf import rtf_to_text
+
+    total_mb = sum(len(data) for _, data in corpus) * repeat / (1024 * 1024)
+    mismatches = 0
+    timings = {'extract_rtf_text': 0.0, 'striprtf': 0.0}
+
+    for name, data in corpus:
+        start = time.perf_counter()
+        for _ in range(repeat):
+            fast = extract_rtf_text(data)
+        timings['extract_rtf_text'] += time.perf_counter() - start
+
+        # Так get_message_body вызывал striprtf до появления extract_rtf_text
+        start = time.perf_counter()
+        try:
+            for _ in range(repeat):
+                slow = rtf_to_text(data.decode('utf-8', errors='replace').strip())
+        except Exception as e:
+            slow = None
+            print(f"[!] striprtf не смог разобрать {name}: {e}")
+        timings['striprtf'] += time.perf_counter() - start
+
+        if slow is None or normalize_for_compare(fast) != normalize_for_compare(slow):
+            mismatches += 1
+            print(f"[!] Расхождение с striprtf: {name}")
+
+    print(f"[+] Файлов: {len(corpus)}, объем: {total_mb:.2f} МБ")
+    for func, seconds in timings.items():
+        speed = total_mb / seconds if seconds else float('inf')
+        print(f"    {func:<18} {seconds:8.3f} с  {speed:8.2f} МБ/с")
+    print(f"[+] Расхождений с striprtf: {mismatches}")
+
+
+def sample_corpus():
+    """Синтетическое письмо в cp1251 с картинкой для замера скорости"""
+    words = 'Добрый день, коллеги! Прошу согласовать отпуск с 06.05 по 07.05. '
+    paragraph = ''.join(f"\\'{b:02x}" if b > 0x7f else chr(b)
+                        for b in words.encode('cp1251'))
+    picture = '{\\*\\shppict{\\pict\\pngblip ' + '89504e470d0a1a0a' * 8192 + '}}'
+    body = ('{\\rtf1\\ansi\\ansicpg1251\\deff0{\\fonttbl{\\f0\\fswiss\\fcharset204 Arial;}}'
+            '{\\colortbl;\\red0\\green0\\blue0;}\\uc1\\pard\\f0 '
+            + (paragraph + '\\par\n') * 2000 + picture + '\\par }')
+    return [('sample.rtf', body.encode('latin-1'))]
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Сравнение extract_rtf_text со striprtf и замер скорости'
+    )
+    parser.add_argument('rtf_files', nargs='*', help='RTF-файлы (например, выгруженные rtf_body)')
+    parser.add_argument('--repeat', type=int, default=3, help='Количество повторов на файл')
+    args = parser.parse_args()
+
+    paths = args.rtf_files or sorted(glob.glob(os.path.join(SAMPLES_DIR, '*.rtf')))
+    corpus = []
+    for path in paths:
+        with open(path, 'rb') as f:
+            corpus.append((path, f.read()))
+    if not args.rtf_files:
+        corpus += sample_corpus()
+
+    ok = check_expected(corpus)
+    benchmark(corpus, args.repeat)
+    if not ok:
+        raise SystemExit(1)
+
+
+if __name__ == '__main__':
+    main()